@@ -1,8 +1,11 @@
+import hashlib
+import orjson
+import sys
 import uvicorn
 from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 # Import the new function from lilypond.py
 from lilypond import convert_to_lilypond 
@@ -37,6 +40,10 @@ class SessionPayload(BaseModel):
 # --- In-Memory Storage ---
 current_session: Optional[SessionPayload] = None
 
+# Rendered PDFs keyed by a hash of the notes they were built from (oldest evicted first)
+PDF_CACHE_SIZE = 16
+_pdf_cache: Dict[bytes, bytes] = {}
+
 # --- API Endpoints ---
 
 @app.post("/api/sessions")
@@ -66,14 +73,26 @@ async def export_pdf():
     if not current_session or not current_session.notes:
         return Response(content="No notes to export. Please Save Session first.", status_code=400)
 
+    notes = current_session.notes
+    cache_key = hashlib.blake2b(orjson.dumps([note.model_dump() for note in notes])).digest()
+    if cache_key in _pdf_cache:
+        print("📄 Serving cached PDF")
+        return Response(content=_pdf_cache[cache_key], media_type="application/pdf")
+
     print("📄 Generating PDF...")
-    pdf_bytes, error = await convert_to_lilypond(current_session.notes) 
+    pdf_bytes, error = await convert_to_lilypond(notes) 
     
     if error:
         return Response(content=error, status_code=500)
+
+    if len(_pdf_cache) >= PDF_CACHE_SIZE:
+        del _pdf_cache[next(iter(_pdf_cache))]
+    _pdf_cache[cache_key] = pdf_bytes
         
     return Response(content=pdf_bytes, media_type="application/pdf")
 
 # --- Run Server ---
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
+    # uvloop has no Windows build; fall back to the stdlib loop there
+    loop = "asyncio" if sys.platform == "win32" else "uvloop"
+    uvicorn.run(app, host="0.0.0.0", port=5000, loop=loop, http="httptools")
\ No newline at end of file
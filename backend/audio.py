@@ -1,9 +1,15 @@
 import asyncio
 import websockets
-import json
+import orjson
+import math
+import queue
+import struct
+import sys
+import threading
 import time
 import numpy as np
-from basic_pitch.inference import Model, ICASSP_2022_MODEL_PATH
+from numba import njit
+from pitch_model import load_model
 
 # --- CONFIGURATION ---
 SAMPLE_RATE = 22050
@@ -17,185 +23,303 @@ NOTE_START_THRESHOLD = 0.5
 NOTE_KEEP_THRESHOLD = 0.25
 MIN_VOLUME = 0.001
 
+# --- WIRE FORMAT ---
+# Volume goes out as a 5-byte binary frame: type byte + little-endian float32.
+# Event batches are JSON arrays, whose first byte '[' never collides with it.
+VOLUME_FRAME_TYPE = 1
+
 # --- COOLDOWN ---
 RETRIGGER_COOLDOWN = 0.12
 
 NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+# Note name for every MIDI number, e.g. NOTE_NAME_CACHE[60] == "C4"
+NOTE_NAME_CACHE = tuple(f"{NOTE_NAMES[m % 12]}{(m // 12) - 1}" for m in range(128))
 
 print("Loading Basic Pitch Model...")
-model = Model(ICASSP_2022_MODEL_PATH)
+model = load_model()
 print("Model Loaded. Ready.")
 
-def midi_to_note_name(midi_number):
-    octave = (midi_number // 12) - 1
-    note_index = midi_number % 12
-    return f"{NOTE_NAMES[note_index]}{octave}"
+# --- INFERENCE WORKER ---
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+def _reject(future, error):
+    if not future.done():
+        future.set_exception(error)
+
+class InferenceWorker:
+    """
+    Persistent thread that runs model.predict for one connection, so hops skip the
+    executor dispatch. Connections infer in parallel; load_model() serializes
+    predict() for models that are not thread-safe.
+    """
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.requests = queue.SimpleQueue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            request = self.requests.get()
+            if request is None: return
+            model_input, future = request
+            try:
+                output = model.predict(model_input)
+            except Exception as e:
+                self.loop.call_soon_threadsafe(_reject, future, e)
+            else:
+                self.loop.call_soon_threadsafe(_resolve, future, output)
+
+    def predict(self, model_input):
+        future = self.loop.create_future()
+        self.requests.put((model_input, future))
+        return future
+
+    def close(self):
+        self.requests.put(None)
+
+@njit(cache=True)
+def detect_kernel(notes_max, onsets_max, active, detected, attacks):
+    """
+    Runs overtone suppression on notes_max in place, then fills the detected
+    and attacks masks for all 88 keys. Held keys use the keep/re-trigger
+    thresholds, silent keys the start/onset thresholds.
+    """
+    # --- SUPPRESSION LOGIC (Iterate High -> Low) ---
+    for i in range(87, 24, -1):
+        prob = notes_max[i]
+        if prob < 0.1: continue
+
+        # CHECK 1: AM I AN OVERTONE?
+        prob_below = notes_max[i - 12]
+        if prob_below > 0.5 and prob < prob_below:
+            notes_max[i] = 0.0
+            continue
+
+        # CHECK 2: AM I CAUSING GHOSTS?
+        if prob > 0.5:
+            for offset in (12, 19):
+                low_idx = i - offset
+                if low_idx >= 0 and notes_max[low_idx] < (prob * 0.9):
+                    notes_max[low_idx] = 0.0
+
+    # --- HYSTERESIS ---
+    for i in range(88):
+        if active[i]:
+            detected[i] = notes_max[i] > NOTE_KEEP_THRESHOLD
+            attacks[i] = onsets_max[i] > RETRIGGER_ONSET_THRESHOLD
+        else:
+            detected[i] = notes_max[i] > NOTE_START_THRESHOLD
+            attacks[i] = onsets_max[i] > ONSET_THRESHOLD
+
+# Compile (or load from cache) now, with the handler's dtypes, so the first
+# non-silent hop doesn't block the event loop for every connection
+detect_kernel(np.zeros(88, dtype=np.float32), np.zeros(88, dtype=np.float32),
+              np.zeros(88, dtype=np.bool_), np.zeros(88, dtype=np.bool_), np.zeros(88, dtype=np.bool_))
 
 async def audio_handler(websocket):
     print(f"Client connected: {websocket.remote_address}")
     
-    audio_buffer = np.zeros((1, WINDOW_LENGTH, 1), dtype=np.float32)
-    input_accumulator = []
-    active_notes = {} 
+    # Ring of two windows: new hops are written at write_pos and the model
+    # sees a view of the last WINDOW_LENGTH samples, so no per-hop np.roll.
+    ring = np.zeros(WINDOW_LENGTH * 2, dtype=np.float32)
+    write_pos = WINDOW_LENGTH
+    scratch = np.empty(HOP_SIZE * 4, dtype=np.float32)
+    fill = 0
+    # Start time of each held key (index = midi - 21); -1.0 marks a key that is not sounding
+    active_starts = np.full(88, -1.0, dtype=np.float64)
+    current_notes_max = np.empty(88, dtype=np.float32)
+    current_onsets_max = np.empty(88, dtype=np.float32)
+    active_mask = np.zeros(88, dtype=np.bool_)
+    detected_mask = np.zeros(88, dtype=np.bool_)
+    attack_mask = np.zeros(88, dtype=np.bool_)
     
     session_start_time = None
     recorded_song = []
 
+    # Set by the receiver once at least one whole hop is buffered, and when it stops
+    hop_ready = asyncio.Event()
+    receiving = True
+
+    async def receive_audio():
+        # Runs alongside inference so incoming audio is buffered, not left queued
+        # on the socket, while the handler is busy
+        nonlocal scratch, fill, receiving
+        try:
+            async for message in websocket:
+                # Audio arrives as binary float32 frames; ignore text and runt frames
+                if isinstance(message, str): continue
+                n = len(message) >> 2
+                if n == 0: continue
+                chunk = np.frombuffer(message, dtype=np.float32, count=n)
+
+                if fill + n > scratch.size:
+                    scratch = np.concatenate([scratch[:fill], np.empty(n + HOP_SIZE, dtype=np.float32)])
+                scratch[fill:fill + n] = chunk
+                fill += n
+                if fill >= HOP_SIZE:
+                    hop_ready.set()
+        finally:
+            receiving = False
+            hop_ready.set()
+
+    receiver = asyncio.create_task(receive_audio())
+    worker = InferenceWorker()
+
     try:
-        async for message in websocket:
-            try:
-                chunk = np.frombuffer(message, dtype=np.float32)
-            except Exception:
+        while True:
+            if fill < HOP_SIZE:
+                if not receiving:
+                    # Re-raises the receiver's ConnectionClosed/error; a clean close just ends
+                    await receiver
+                    break
+                await hop_ready.wait()
+                hop_ready.clear()
                 continue
-            if len(chunk) == 0: continue
 
-            input_accumulator.extend(chunk)
-            if len(input_accumulator) < HOP_SIZE: continue
+            # --- LATEST WINS ---
+            # If inference fell behind, several hops are buffered. Advance the window
+            # over all of them and infer once on the newest window instead of
+            # working through a backlog.
+            consumed = (fill // HOP_SIZE) * HOP_SIZE
+            if consumed >= WINDOW_LENGTH:
+                ring[:WINDOW_LENGTH] = scratch[consumed - WINDOW_LENGTH:consumed]
+                write_pos = WINDOW_LENGTH
+            else:
+                if write_pos + consumed > ring.size:
+                    ring[:WINDOW_LENGTH] = ring[write_pos - WINDOW_LENGTH:write_pos]
+                    write_pos = WINDOW_LENGTH
+                ring[write_pos:write_pos + consumed] = scratch[:consumed]
+                write_pos += consumed
+            model_input = ring[write_pos - WINDOW_LENGTH:write_pos].reshape(1, WINDOW_LENGTH, 1)
+            new_data = scratch[consumed - HOP_SIZE:consumed].copy()
+            scratch[:fill - consumed] = scratch[consumed:fill]
+            fill -= consumed
 
-            new_data = np.array(input_accumulator[:HOP_SIZE], dtype=np.float32)
-            input_accumulator = input_accumulator[HOP_SIZE:]
+            volume = math.sqrt(np.dot(new_data, new_data) / new_data.size)
+            is_silent = volume < MIN_VOLUME
+            held_idx = np.flatnonzero(active_starts >= 0)
+            # Nothing to report on a silent hop with no held notes
+            if not is_silent or held_idx.size:
+                await websocket.send(struct.pack('<Bf', VOLUME_FRAME_TYPE, volume))
 
-            audio_buffer = np.roll(audio_buffer, -HOP_SIZE, axis=1)
-            audio_buffer[0, -HOP_SIZE:, 0] = new_data
-
-            volume = float(np.sqrt(np.mean(new_data**2)))
-            await websocket.send(json.dumps({"type": "volume", "value": volume}))
+            # Every event for this hop is collected here and sent as one JSON array frame.
+            # orjson emits bytes, so this is a binary frame too.
+            events = []
             
             # --- SILENCE HANDLING ---
-            if volume < MIN_VOLUME:
-                if active_notes:
+            if is_silent:
+                if held_idx.size:
                     now = time.time()
-                    for midi_num, start in active_notes.items():
+                    for i in held_idx:
+                        midi_num = int(i) + 21
+                        start = active_starts[i]
                         rel_start = start - session_start_time
                         dur = now - start
-                        note_data = {"note": midi_to_note_name(midi_num), "midi": midi_num, "start_time": round(rel_start, 3), "duration": round(dur, 3)}
+                        note_data = {"note": NOTE_NAME_CACHE[midi_num], "midi": midi_num, "start_time": round(rel_start, 3), "duration": round(dur, 3)}
                         recorded_song.append(note_data)
-                        await websocket.send(json.dumps({"type": "note_off", **note_data}))
-                    active_notes = {}
-                    await websocket.send(json.dumps({"type": "silence_reset"}))
+                        events.append({"type": "note_off", **note_data})
+                    active_starts.fill(-1.0)
+                    events.append({"type": "silence_reset"})
+                    await websocket.send(orjson.dumps(events, option=orjson.OPT_SERIALIZE_NUMPY))
                 continue
 
             # --- AI PROCESSING ---
-            loop = asyncio.get_running_loop()
-            output = await loop.run_in_executor(None, lambda: model.predict(audio_buffer))
+            output = await worker.predict(model_input)
             
             note_probs = output['note']
             onset_probs = output['onset']
             if note_probs is None: continue
 
             focus = 8
-            current_notes_max = np.max(note_probs[0, -focus:, :], axis=0)
-            current_onsets_max = np.max(onset_probs[0, -focus:, :], axis=0)
-
-            # --- SUPPRESSION LOGIC (Iterate High -> Low) ---
-            for i in range(87, 24, -1): 
-                prob = current_notes_max[i]
-                if prob < 0.1: continue 
-
-                # CHECK 1: AM I AN OVERTONE?
-                idx_below = i - 12
-                if idx_below >= 0:
-                    prob_below = current_notes_max[idx_below]
-                    if prob_below > 0.5 and prob < prob_below:
-                        current_notes_max[i] = 0.0
-                        continue
-
-                # CHECK 2: AM I CAUSING GHOSTS?
-                if prob > 0.5: 
-                    for offset in [12, 19]: 
-                        low_idx = i - offset
-                        if low_idx >= 0:
-                            prob_low = current_notes_max[low_idx]
-                            if prob_low < (prob * 0.9): 
-                                current_notes_max[low_idx] = 0.0
+            np.max(note_probs[0, -focus:, :], axis=0, out=current_notes_max)
+            np.max(onset_probs[0, -focus:, :], axis=0, out=current_onsets_max)
+
+            # Suppression and threshold tests run natively; Python only walks the hits
+            np.greater_equal(active_starts, 0, out=active_mask)
+            detect_kernel(current_notes_max, current_onsets_max, active_mask, detected_mask, attack_mask)
 
-            
             now = time.time()
-            detected_this_frame = set()
+            # Held keys that dropped out this frame, taken before any new note starts
+            ended_idx = np.flatnonzero(active_mask & ~detected_mask)
 
-            for i in range(88):
-                midi_num = i + 21
-                prob_note = current_notes_max[i]
-                prob_onset = current_onsets_max[i]
+            for i in np.flatnonzero(detected_mask):
+                midi_num = int(i) + 21
+                is_active = active_mask[i]
+                is_attack = attack_mask[i]
                 
-                # Standard Hysteresis
-                is_active = midi_num in active_notes
-                thresh = NOTE_KEEP_THRESHOLD if is_active else NOTE_START_THRESHOLD
-                
-                is_sustaining = prob_note > thresh
-
-                # Differentiate between starting a new note and re-triggering an old one
-                is_standard_attack = prob_onset > ONSET_THRESHOLD
-                is_retrigger_attack = prob_onset > RETRIGGER_ONSET_THRESHOLD
-
-                if is_sustaining:
-                    detected_this_frame.add(midi_num)
-                    
-                    if is_active:
-                        # --- RETRIGGER LOGIC (Fixed for E4 Issue) ---
-                        # Use stricter threshold and ensure cooldown
-                        if is_retrigger_attack and (now - active_notes[midi_num]) > RETRIGGER_COOLDOWN:
-                            old_start = active_notes[midi_num]
-                            duration = now - old_start
-                            rel_start = old_start - session_start_time
-
-                            note_data = {
-                                "note": midi_to_note_name(midi_num), 
-                                "midi": midi_num, 
-                                "start_time": round(rel_start, 3), 
-                                "duration": round(duration, 3)
-                            }
-                            
-                            # 1. Archive the old note
-                            recorded_song.append(note_data)
-                            
-                            # 2. Send Note OFF for the previous instance (Crucial Fix)
-                            await websocket.send(json.dumps({"type": "note_off", **note_data}))
-
-                            # 3. Start the new note instance
-                            active_notes[midi_num] = now
-                            await websocket.send(json.dumps({
-                                "type": "note_on", 
-                                "note": midi_to_note_name(midi_num), 
-                                "midi": midi_num,
-                                "event": "re_trigger", 
-                                "start_time": round(now - session_start_time, 3)
-                            }))
-                    else:
-                        # --- NEW NOTE LOGIC (Fixed for G4 Issue) ---
-                        # Only start if it meets the standard threshold (not retrigger logic)
-                        if is_standard_attack:
-                            if session_start_time is None: session_start_time = now
-                            active_notes[midi_num] = now
-                            await websocket.send(json.dumps({
-                                "type": "note_on", 
-                                "note": midi_to_note_name(midi_num), 
-                                "midi": midi_num,
-                                "event": "new_attack", 
-                                "start_time": round(now - session_start_time, 3)
-                            }))
+                if is_active:
+                    # --- RETRIGGER LOGIC (Fixed for E4 Issue) ---
+                    # Use stricter threshold and ensure cooldown
+                    if is_attack and (now - active_starts[i]) > RETRIGGER_COOLDOWN:
+                        old_start = active_starts[i]
+                        duration = now - old_start
+                        rel_start = old_start - session_start_time
+
+                        note_data = {
+                            "note": NOTE_NAME_CACHE[midi_num], 
+                            "midi": midi_num, 
+                            "start_time": round(rel_start, 3), 
+                            "duration": round(duration, 3)
+                        }
+                        
+                        # 1. Archive the old note
+                        recorded_song.append(note_data)
+                        
+                        # 2. Send Note OFF for the previous instance (Crucial Fix)
+                        events.append({"type": "note_off", **note_data})
+
+                        # 3. Start the new note instance
+                        active_starts[i] = now
+                        events.append({
+                            "type": "note_on", 
+                            "note": NOTE_NAME_CACHE[midi_num], 
+                            "midi": midi_num,
+                            "event": "re_trigger", 
+                            "start_time": round(now - session_start_time, 3)
+                        })
+                else:
+                    # --- NEW NOTE LOGIC (Fixed for G4 Issue) ---
+                    # Only start if it meets the standard threshold (not retrigger logic)
+                    if is_attack:
+                        if session_start_time is None: session_start_time = now
+                        active_starts[i] = now
+                        events.append({
+                            "type": "note_on", 
+                            "note": NOTE_NAME_CACHE[midi_num], 
+                            "midi": midi_num,
+                            "event": "new_attack", 
+                            "start_time": round(now - session_start_time, 3)
+                        })
 
             # --- CLEANUP ---
-            for midi_num in list(active_notes.keys()):
-                if midi_num not in detected_this_frame:
-                    start_time = active_notes[midi_num]
-                    duration = now - start_time
-                    rel_start = start_time - session_start_time
-                    
-                    note_info = {
-                        "note": midi_to_note_name(midi_num),
-                        "midi": midi_num,
-                        "start_time": round(rel_start, 3),
-                        "duration": round(duration, 3)
-                    }
-                    recorded_song.append(note_info)
-                    del active_notes[midi_num]
-                    await websocket.send(json.dumps({"type": "note_off", **note_info}))
+            for i in ended_idx:
+                midi_num = int(i) + 21
+                start_time = active_starts[i]
+                duration = now - start_time
+                rel_start = start_time - session_start_time
+                
+                note_info = {
+                    "note": NOTE_NAME_CACHE[midi_num],
+                    "midi": midi_num,
+                    "start_time": round(rel_start, 3),
+                    "duration": round(duration, 3)
+                }
+                recorded_song.append(note_info)
+                active_starts[i] = -1.0
+                events.append({"type": "note_off", **note_info})
+
+            if events:
+                await websocket.send(orjson.dumps(events, option=orjson.OPT_SERIALIZE_NUMPY))
 
     except websockets.exceptions.ConnectionClosed:
         print(f"Connection closed. Notes recorded: {len(recorded_song)}")
     except Exception as e:
         print(f"Error: {e}")
+    finally:
+        receiver.cancel()
+        worker.close()
 
 async def main():
     print("Server running on localhost:8000")
@@ -203,4 +327,9 @@ async def main():
         await asyncio.Future()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    # uvloop has no Windows build; fall back to the stdlib loop there
+    if sys.platform == "win32":
+        asyncio.run(main())
+    else:
+        import uvloop
+        uvloop.run(main())
\ No newline at end of file
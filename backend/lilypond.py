@@ -1,35 +1,47 @@
 import asyncio
+import functools
 import subprocess
 import os
-import uuid
+import tempfile
 import sys
 import traceback
 
+# VexFlow base durations (w, h, q, 8, 16, 32) -> LilyPond numbers (1, 2, 4, 8, 16, 32)
+_BASE_DURATIONS = {
+    'w': '1',
+    'h': '2',
+    'q': '4',
+    '8': '8',
+    '16': '16',
+    '32': '32'
+}
+
+# Every spelling VexFlow produces: plain, dotted ('qd' -> '4.') and rest-marked
+# ('qr', 'rq', 'qdr', ...), all lowercase.
+DURATION_MAP = {
+    spelling: lily
+    for base, num in _BASE_DURATIONS.items()
+    for dot, lily in (('', num), ('d', num + '.'))
+    for spelling in (base + dot, base + dot + 'r', base + 'r' + dot, 'r' + base + dot)
+}
+
 def parse_vexflow_duration(duration_str):
     """
     Converts VexFlow duration codes (w, h, q, 8, 16) to LilyPond numbers (1, 2, 4, 8, 16).
     Handles dots (e.g., 'qd' -> '4.').
     """
-    # Remove 'r' (rest) and 'd' (dot) for the base calculation
-    clean_dur = duration_str.lower().replace('r', '').replace('d', '')
-    
-    mapping = {
-        'w': '1',
-        'h': '2',
-        'q': '4',
-        '8': '8',
-        '16': '16',
-        '32': '32'
-    }
-    
-    lily_dur = mapping.get(clean_dur, '4') # Default to quarter if unknown
-    
-    # Add dot back if original string had 'd'
-    if 'd' in duration_str.lower():
+    clean_dur = duration_str.lower()
+    lily_dur = DURATION_MAP.get(clean_dur)
+    if lily_dur is not None:
+        return lily_dur
+
+    # Unusual spelling: strip 'r' (rest) and 'd' (dot), default to quarter if unknown
+    lily_dur = _BASE_DURATIONS.get(clean_dur.replace('r', '').replace('d', ''), '4')
+    if 'd' in clean_dur:
         lily_dur += "."
-        
     return lily_dur
 
+@functools.lru_cache(maxsize=4096)
 def parse_vexflow_pitch(vex_key):
     """
     Converts VexFlow key "c#/4" to LilyPond "cis'".
@@ -84,7 +96,7 @@ def edit_notes(notes):
     """
     Parses list of Note objects into a LilyPond string.
     """
-    lily_string = ""
+    parts = []
     
     for note in notes:
         # Determine if it's a dict (raw json) or Pydantic model
@@ -102,26 +114,21 @@ def edit_notes(notes):
         # STRICT REST CHECK: Only render rest if isRest is explicitly True.
         # This ignores 'qr' or '8r' codes in duration if the note is actually audible.
         if is_rest:
-            lily_string += f" r{lily_dur}"
+            parts.append(f"r{lily_dur}")
         elif len(keys) > 0:
             if len(keys) > 1:
                 # CHORD
                 pitches = [parse_vexflow_pitch(k) for k in keys]
                 chord_str = " ".join(pitches)
-                lily_string += f" <{chord_str}>{lily_dur}"
+                parts.append(f"<{chord_str}>{lily_dur}")
             else:
                 # SINGLE NOTE
                 pitch = parse_vexflow_pitch(keys[0])
-                lily_string += f" {pitch}{lily_dur}"
+                parts.append(f"{pitch}{lily_dur}")
             
-    return lily_string.strip()
+    return " ".join(parts)
 
 async def convert_to_lilypond(notes):
-    unique_id = str(uuid.uuid4())
-    base_filename = f"temp_{unique_id}"
-    ly_filename = f"{base_filename}.ly"
-    pdf_filename = f"{base_filename}.pdf"
-
     music_notes = edit_notes(notes)
     
     lilypond_content = f"""
@@ -140,45 +147,42 @@ async def convert_to_lilypond(notes):
 """
 
     try:
-        with open(ly_filename, "w") as f:
-            f.write(lilypond_content)
-
-        cmd = ["lilypond", "--output", base_filename, ly_filename]
-        
-        if sys.platform == "win32":
-            process = await asyncio.to_thread(
-                subprocess.run, cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False
-            )
-            returncode = process.returncode
-            stderr = process.stderr
-        else:
-            process = await asyncio.create_subprocess_exec(
-                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
-            returncode = process.returncode
-
-        if returncode != 0:
-            error_msg = stderr.decode()
-            print(f"LILYPOND ERROR:\n{error_msg}")
-            return None, f"LilyPond Error: {error_msg}"
-
-        if os.path.exists(pdf_filename):
-            with open(pdf_filename, "rb") as f:
-                pdf_bytes = f.read()
-            return pdf_bytes, None
-        else:
-            return None, "PDF created but file not found."
+        # The score is piped in on stdin, so no .ly file is written. LilyPond cannot
+        # stream the PDF to stdout, so it (and any .log) lands in a private temp dir
+        # that is removed as a whole.
+        with tempfile.TemporaryDirectory() as out_dir:
+            base_filename = os.path.join(out_dir, "score")
+            pdf_filename = f"{base_filename}.pdf"
+            source = lilypond_content.encode()
+
+            cmd = ["lilypond", "--pdf", "--output", base_filename, "-"]
+            
+            if sys.platform == "win32":
+                process = await asyncio.to_thread(
+                    subprocess.run, cmd, input=source, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False
+                )
+                returncode = process.returncode
+                stderr = process.stderr
+            else:
+                process = await asyncio.create_subprocess_exec(
+                    *cmd, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+                )
+                stdout, stderr = await process.communicate(source)
+                returncode = process.returncode
+
+            if returncode != 0:
+                error_msg = stderr.decode()
+                print(f"LILYPOND ERROR:\n{error_msg}")
+                return None, f"LilyPond Error: {error_msg}"
+
+            if os.path.exists(pdf_filename):
+                with open(pdf_filename, "rb") as f:
+                    pdf_bytes = f.read()
+                return pdf_bytes, None
+            else:
+                return None, "PDF created but file not found."
 
     except Exception:
         full_error = traceback.format_exc()
         print(f"CRITICAL ERROR:\n{full_error}")
         return None, f"Server Error: {full_error}"
-
-    finally:
-        if os.path.exists(ly_filename):
-            os.remove(ly_filename)
-        if os.path.exists(pdf_filename):
-            os.remove(pdf_filename)
-        if os.path.exists(f"{base_filename}.log"):
-            os.remove(f"{base_filename}.log")
\ No newline at end of file
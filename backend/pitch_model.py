@@ -0,0 +1,93 @@
+import logging
+import os
+import threading
+from basic_pitch import FilenameSuffix, build_icassp_2022_model_path
+from basic_pitch.inference import Model, ICASSP_2022_MODEL_PATH
+
+# Float16-weight TFLite build of the ICASSP 2022 model, produced by running this file.
+# It only halves the file size (weights are widened back to float32 on CPU), so it
+# is used only when opted in with USE_FP16_MODEL=1.
+FP16_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "basic_pitch_fp16.tflite")
+USE_FP16_MODEL = os.environ.get("USE_FP16_MODEL") == "1"
+
+def export_fp16_model(output_path=FP16_MODEL_PATH):
+    """
+    Converts the stock ICASSP 2022 saved model to a TFLite file with float16 weights.
+    Needs TensorFlow, so it is a one-off build step rather than a server dependency.
+    """
+    import tensorflow as tf
+
+    saved_model_dir = str(build_icassp_2022_model_path(FilenameSuffix.tf))
+    converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.target_spec.supported_types = [tf.float16]
+
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+    return output_path
+
+# Execution providers in order of preference; only those in the installed build are used
+ONNX_PROVIDERS = ["CUDAExecutionProvider", "CoreMLExecutionProvider", "DmlExecutionProvider", "CPUExecutionProvider"]
+
+class OnnxModel:
+    """
+    Runs the ONNX build of the ICASSP 2022 model that ships with basic_pitch, with
+    full graph optimization and GPU providers when available. predict() returns the
+    same {"note", "onset", "contour"} dict as basic_pitch's Model.
+    """
+    OUTPUT_NAMES = ["StatefulPartitionedCall:1", "StatefulPartitionedCall:2", "StatefulPartitionedCall:0"]
+
+    def __init__(self, model_path=build_icassp_2022_model_path(FilenameSuffix.onnx)):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        available = ort.get_available_providers()
+        providers = [p for p in ONNX_PROVIDERS if p in available]
+
+        self.session = ort.InferenceSession(str(model_path), sess_options=options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, x):
+        note, onset, contour = self.session.run(self.OUTPUT_NAMES, {self.input_name: x})
+        return {"note": note, "onset": onset, "contour": contour}
+
+class SerializedModel:
+    """
+    Wraps a basic_pitch Model so predict() runs one call at a time. Its TFLite and
+    TensorFlow backends share one interpreter/graph between calls, which is not safe
+    to drive from several connection threads at once.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+
+    def predict(self, x):
+        with self.lock:
+            return self.model.predict(x)
+
+def load_model(use_fp16=USE_FP16_MODEL):
+    """
+    Returns a model with basic_pitch's predict() interface. Uses ONNX Runtime, falling
+    back to the stock FP32 model; the float16 TFLite build is tried first only when
+    use_fp16 is set and the file has been exported.
+    """
+    if use_fp16 and os.path.exists(FP16_MODEL_PATH):
+        try:
+            model = SerializedModel(Model(FP16_MODEL_PATH))
+            print(f"Using quantized model: {FP16_MODEL_PATH}")
+            return model
+        except Exception as e:
+            print(f"Quantized model failed to load ({e}), trying ONNX Runtime.")
+    try:
+        model = OnnxModel()
+    except ImportError as e:
+        # Only a missing onnxruntime falls back; real session errors propagate
+        logging.warning("onnxruntime is not installed (%s); falling back to the slower stock basic_pitch model.", e)
+    else:
+        print(f"Using ONNX Runtime: {model.session.get_providers()}")
+        return model
+    return SerializedModel(Model(ICASSP_2022_MODEL_PATH))
+
+if __name__ == "__main__":
+    print(f"Exported {export_fp16_model()}")
@@ -11,6 +11,10 @@ interface NoteEvent {
   start_time?: number;
 }
 
+// Must match VOLUME_FRAME_TYPE in backend/audio.py
+const VOLUME_FRAME_TYPE = 1;
+const textDecoder = new TextDecoder();
+
 export const RecordButton: React.FC = () => {
   const [isRecording, setIsRecording] = useState(false);
   
@@ -60,6 +64,8 @@ export const RecordButton: React.FC = () => {
 
   const startStreaming = async () => {
     socketRef.current = new WebSocket('ws://localhost:8000');
+    // Volume and event batches both arrive as binary frames
+    socketRef.current.binaryType = 'arraybuffer';
 
     socketRef.current.onopen = async () => {
       console.log("WebSocket connected. Starting Audio...");
@@ -105,8 +111,18 @@ export const RecordButton: React.FC = () => {
 
     socketRef.current.onmessage = (event) => {
       try {
-        const data: NoteEvent = JSON.parse(event.data);
-        handleServerEvent(data);
+        // Binary frames starting with VOLUME_FRAME_TYPE carry a float32 volume;
+        // everything else is a JSON array batching one audio hop's events
+        if (event.data instanceof ArrayBuffer) {
+          const view = new DataView(event.data);
+          if (view.byteLength === 5 && view.getUint8(0) === VOLUME_FRAME_TYPE) {
+            handleServerEvent({ type: 'volume', value: view.getFloat32(1, true) });
+            return;
+          }
+        }
+        const text = typeof event.data === 'string' ? event.data : textDecoder.decode(event.data);
+        const events: NoteEvent[] = JSON.parse(text);
+        events.forEach(handleServerEvent);
       } catch (e) {
         console.error("JSON Parse Error", e);
       }